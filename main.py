@@ -1,12 +1,32 @@
-import argparse
+# argparse, shutil, and subprocess are imported lazily by the few functions
+# that need them; they are off the hot path and only slow down startup.
+from __future__ import annotations
+
 import http.client
 import json
 import os
-import shutil
-import subprocess
+import queue
+import socket
 import sys
+import threading
 import time
-from typing import Dict, List, Optional
+from dataclasses import dataclass
+from typing import Dict, List, Optional, TextIO
+
+try:
+    # orjson works on bytes directly and is considerably faster both ways; it
+    # is optional, so fall back to stdlib equivalents: a single decoder bound
+    # once (json.loads re-creates one per call) and a compact dumps that
+    # skips the str-then-encode double allocation as far as possible.
+    from orjson import dumps as _dumps, loads as _loads
+except ImportError:
+    _json_decoder = json.JSONDecoder()
+
+    def _loads(data: bytes) -> Dict:
+        return _json_decoder.decode(data.decode("utf-8"))
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
 
 DEFAULT_HOST = os.environ.get("OLLAMA_HOST", "127.0.0.1")
 DEFAULT_PORT = int(os.environ.get("OLLAMA_PORT", "11434"))
@@ -15,25 +35,135 @@ DEFAULT_MODEL = os.environ.get("OLLAMA_MODEL", "smollm2:1.7b")
 def print_err(message: str) -> None:
     print(message, file=sys.stderr, flush=True)
 
-def is_ollama_running(host: str, port: int) -> bool:
+# Bound once so the token loop skips the attribute lookups, and tokens are
+# flushed in batches rather than paying an fflush() syscall per token.
+_write = sys.stdout.write
+_flush = sys.stdout.flush
+_FLUSH_EVERY = 16  # tokens between forced flushes when no newline arrives
+
+# A tiny pool of keep-alive connections keyed by (host, port). This is a
+# stdlib stand-in for requests.Session: sockets are reused across requests
+# and a request is retried once if the daemon dropped the idle connection.
+_POOL: Dict[tuple, http.client.HTTPConnection] = {}
+
+
+def _get_conn(host: str, port: int, timeout: float = 60) -> http.client.HTTPConnection:
+    """Return the pooled connection for (host, port), creating it if needed."""
+    key = (host, port)
+    conn = _POOL.get(key)
+    if conn is None:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        conn.connect()
+        _tune_socket(conn)
+        _POOL[key] = conn
+    else:
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+    return conn
+
+
+def _tune_socket(conn: http.client.HTTPConnection) -> None:
+    """Disable Nagle and widen the receive buffer on a freshly connected socket.
+
+    Token streaming is a ping-pong workload dominated by per-packet latency,
+    so waiting for Nagle/delayed-ACK coalescing only adds stalls between
+    tokens.
+    """
+    sock = conn.sock
+    if sock is None:
+        return
     try:
-        conn = http.client.HTTPConnection(host, port, timeout=2)
-        conn.request("GET", "/api/version")
-        resp = conn.getresponse()
-        return resp.status == 200
-    except Exception:
-        return False
-    finally:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    except OSError:
+        pass
+
+
+def _drop_conn(host: str, port: int) -> None:
+    conn = _POOL.pop((host, port), None)
+    if conn is not None:
         try:
             conn.close()
         except Exception:
             pass
 
-def ensure_model_available(model: str) -> None:
+
+def _request(
+    host: str,
+    port: int,
+    method: str,
+    path: str,
+    body: Optional[bytes] = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: float = 60,
+) -> http.client.HTTPResponse:
+    """Issue a request on the pooled connection, retrying once on a stale socket."""
+    all_headers = {"Connection": "keep-alive"}
+    if headers:
+        all_headers.update(headers)
+    conn = _get_conn(host, port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=all_headers)
+        return conn.getresponse()
+    except (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionError):
+        _drop_conn(host, port)
+        conn = _get_conn(host, port, timeout=timeout)
+        conn.request(method, path, body=body, headers=all_headers)
+        return conn.getresponse()
+
+
+def is_ollama_running(host: str, port: int) -> bool:
+    """Probe the daemon, leaving a warm pooled connection behind on success.
+
+    The GET goes through the shared pool, so the socket it opens is the same
+    one the first /api/chat POST will reuse - the health check doubles as a
+    connection pre-warm and the first user message skips the TCP handshake.
+    """
+    try:
+        resp = _request(host, port, "GET", "/api/version", timeout=2)
+        resp.read()  # drain so the connection can be reused
+        return resp.status == 200
+    except Exception:
+        _drop_conn(host, port)
+        return False
+
+# Models already confirmed present, so repeat calls skip the subprocess fork.
+_KNOWN_MODELS: set[str] = set()
+
+
+def _list_local_models(host: str, port: int) -> None:
+    """Populate _KNOWN_MODELS in bulk from /api/tags over the pooled connection."""
+    try:
+        resp = _request(host, port, "GET", "/api/tags", timeout=2)
+        data = resp.read()
+        if resp.status != 200:
+            return
+        for entry in _loads(data).get("models", []):
+            name = entry.get("name")
+            if name:
+                _KNOWN_MODELS.add(name)
+    except Exception:
+        _drop_conn(host, port)
+
+
+def ensure_model_available(model: str, host: str, port: int) -> None:
     """Ensure the model is available locally; attempt to pull if missing.
 
-    Uses the `ollama` CLI if present. If not available, prints a hint.
+    Checks /api/tags first (cheap HTTP call on the pooled connection) and only
+    falls back to the `ollama` CLI when the model is genuinely absent. Results
+    are cached so the subprocess fork happens at most once per model.
     """
+    if model in _KNOWN_MODELS:
+        return
+
+    _list_local_models(host, port)
+    if model in _KNOWN_MODELS:
+        return
+
+    import shutil
+    import subprocess
+
     ollama_cli = shutil.which("ollama")
     if not ollama_cli:
         print_err("'ollama' CLI not found in PATH. Skipping auto-pull.")
@@ -48,219 +178,368 @@ def ensure_model_available(model: str) -> None:
             check=False,
         )
         if check.returncode == 0:
+            _KNOWN_MODELS.add(model)
             return
     except Exception:
         pass
 
     print_err(f"Pulling model '{model}' via ollama... This may take a while on first run.")
     try:
-        pull = subprocess.run([ollama_cli, "pull", model], check=False)
-        if pull.returncode != 0:
+        # Stream the pull output line by line so the user sees progress
+        # immediately instead of staring at a silent blocking child process.
+        proc = subprocess.Popen(
+            [ollama_cli, "pull", model],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=1,
+            text=True,
+        )
+        for line in proc.stdout:
+            print_err(line.rstrip())
+        if proc.wait() != 0:
             print_err("Failed to pull model via ollama CLI. You can pull manually:")
             print_err(f"  ollama pull {model}")
+        else:
+            _KNOWN_MODELS.add(model)
     except FileNotFoundError:
         print_err("'ollama' CLI not found in PATH. Install from https://ollama.com")
 
 
-def stream_chat(
-    host: str,
-    port: int,
-    model: str,
-    messages: List[Dict[str, str]],
-    options: Optional[Dict] = None,
-    stream: bool = True,
-) -> Dict:
+_MAX_HISTORY = 32  # non-system messages sent per request
+
+
+@dataclass(slots=True)
+class Message:
+    """One chat message plus its JSON encoding, computed once at creation.
+
+    Slots keep per-message overhead far below a dict's, and caching the
+    encoded form preserves the encode-once property: the transcript is never
+    re-serialized as a whole, only joined from these fragments.
+    """
+
+    role: str
+    content: str
+    encoded: bytes = b""
+
+    def __post_init__(self) -> None:
+        if not self.encoded:
+            self.encoded = _dumps({"role": self.role, "content": self.content})
+
+
+def _payload_prefix(body: Dict) -> bytes:
+    """Serialize the invariant request fields and open the messages array."""
+    return _dumps(body)[:-1] + b',"messages":['
+
+
+def _build_payload(prefix: bytes, messages: List[Message]) -> bytes:
+    return prefix + b",".join(m.encoded for m in messages) + b"]}"
+
+
+def _trim_history(history: List[Message], max_msgs: int = _MAX_HISTORY) -> List[Message]:
+    """Return the system message (if any) plus the last max_msgs messages.
+
+    Re-sending the whole transcript every turn makes request size grow
+    without bound and silently overruns num_ctx; a sliding window keeps
+    per-turn serialization cost constant. The full history list is left
+    untouched so /save still records the complete conversation.
+    """
+    if history and history[0].role == "system":
+        system, rest = history[:1], history[1:]
+        if len(rest) <= max_msgs:
+            return history
+        return system + rest[-max_msgs:]
+    if len(history) <= max_msgs:
+        return history
+    return history[-max_msgs:]
+
+
+def stream_chat(host: str, port: int, payload: bytes) -> Dict:
     """Send a chat request to Ollama and stream tokens as they arrive.
 
+    `payload` is the already-serialized /api/chat request body; callers
+    assemble it from a per-session prefix plus pre-encoded message fragments
+    so only the newest message pays an encode per turn.
+
     Returns the final response dict from Ollama (the last JSON object with done=true).
     """
-    body = {
-        "model": model,
-        "messages": messages,
-        "stream": stream,
-    }
-    if options:
-        body["options"] = options
+    resp = _request(
+        host,
+        port,
+        "POST",
+        "/api/chat",
+        body=payload,
+        headers={
+            "Content-Type": "application/json",
+            "Content-Length": str(len(payload)),
+        },
+        timeout=60,
+    )
 
-    conn = http.client.HTTPConnection(host, port, timeout=60)
     try:
-        conn.request(
-            "POST",
-            "/api/chat",
-            body=json.dumps(body).encode("utf-8"),
-            headers={"Content-Type": "application/json"},
-        )
-        resp = conn.getresponse()
         if resp.status != 200:
             data = resp.read().decode("utf-8", errors="replace")
             raise RuntimeError(f"Ollama error {resp.status}: {data}")
 
+        # A small reader thread pulls NDJSON lines off the socket while the
+        # main thread parses and prints them, so JSON decoding and stdout
+        # writes overlap the wait for the next TCP chunk. readline releases
+        # the GIL inside recv, making the overlap real. HTTPResponse is
+        # already a buffered reader, so each readline() is one allocation.
+        lines: queue.SimpleQueue = queue.SimpleQueue()
+
+        def _read_lines() -> None:
+            try:
+                for raw in iter(resp.readline, b""):
+                    lines.put(raw)
+            except Exception as exc:
+                lines.put(exc)
+            finally:
+                lines.put(None)
+
+        reader = threading.Thread(target=_read_lines, daemon=True)
+        reader.start()
+
         final: Dict = {}
-        buffer = b""
+        # Tokens arriving in a burst (fast models deliver several NDJSON
+        # events per TCP read) are joined and emitted as a single write
+        # rather than one write call per token.
+        parts: List[str] = []
         while True:
-            chunk = resp.read(4096)
-            if not chunk:
+            item = lines.get()
+            if item is None:
                 break
-            buffer += chunk
-            while b"\n" in buffer:
-                line, buffer = buffer.split(b"\n", 1)
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    event = json.loads(line.decode("utf-8"))
-                except json.JSONDecodeError:
-                    continue
+            if isinstance(item, Exception):
+                raise item
 
-                message = event.get("message") or {}
-                content = message.get("content", "")
-                if content:
-                    print(content, end="", flush=True)
+            line = item.strip()
+            if not line:
+                continue
+            try:
+                event = _loads(line)
+            except ValueError:
+                continue
+
+            message = event.get("message") or {}
+            content = message.get("content", "")
+            if content:
+                parts.append(content)
+                if "\n" in content or len(parts) >= _FLUSH_EVERY:
+                    _write("".join(parts))
+                    _flush()
+                    parts.clear()
+
+            if event.get("done"):
+                final = event
+
+        reader.join()
+        if final:
+            parts.append("\n")
+        if parts:
+            _write("".join(parts))
+            _flush()
+        resp.read()  # drain any trailing bytes so the socket stays reusable
+        return final
+    except Exception:
+        # The response may be left half-read; drop the connection rather than
+        # risk reusing a socket with stale data on it.
+        _drop_conn(host, port)
+        raise
 
-                if event.get("done"):
-                    final = event
-                    print()
-                    return final
 
-        return final
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+@dataclass(slots=True)
+class Session:
+    """Per-session state shared by the interactive loop and one-shot path."""
 
+    model: str
+    system_prompt: Optional[str]
+    history: List[Message]
+    prefix: bytes
+    transcript: Optional[TextIO] = None
 
-def interactive_chat(
+
+def _prepare_session(
     model: str,
     system_prompt: Optional[str],
-    temperature: Optional[float],
-    num_ctx: Optional[int],
-    num_predict: Optional[int],
+    options: Dict,
     no_stream: bool,
-) -> None:
+) -> Optional[Session]:
+    """Probe the daemon, ensure the model, and seed the session state.
+
+    This is the single place where the daemon check, model availability, and
+    request-prefix setup happen; both entry points go through it. Returns
+    None when the daemon is unreachable.
+    """
     if not is_ollama_running(DEFAULT_HOST, DEFAULT_PORT):
         print_err(
             f"Cannot reach Ollama at http://{DEFAULT_HOST}:{DEFAULT_PORT}. Is the daemon running?"
         )
         print_err("Start it with: ollama serve")
-        return
+        return None
 
-    ensure_model_available(model)
+    ensure_model_available(model, DEFAULT_HOST, DEFAULT_PORT)
 
-    history: List[Dict[str, str]] = []
+    history: List[Message] = []
     if system_prompt:
-        history.append({"role": "system", "content": system_prompt})
+        history.append(Message("system", system_prompt))
+
+    # Everything but "messages" is invariant for the session, so serialize it
+    # once; per-turn payloads are assembled by joining the pre-encoded
+    # message fragments onto this prefix.
+    body: Dict = {"model": model, "stream": not no_stream}
+    if options:
+        body["options"] = options
+
+    return Session(
+        model=model,
+        system_prompt=system_prompt,
+        history=history,
+        prefix=_payload_prefix(body),
+    )
+
+
+_HELP = (
+    "Commands:\n"
+    "  /exit or /quit   Exit the chat\n"
+    "  /reset           Reset the conversation history\n"
+    "  /save <path>     Save transcript to a JSON file\n"
+    "  /help            Show this help\n"
+)
+
+
+def _cmd_exit(arg: str, session: Session) -> bool:
+    return False
+
+
+def _cmd_help(arg: str, session: Session) -> bool:
+    print(_HELP)
+    return True
+
+
+def _cmd_reset(arg: str, session: Session) -> bool:
+    system_prompt = session.system_prompt
+    session.history = [Message("system", system_prompt)] if system_prompt else []
+    print("History reset.")
+    return True
+
+
+def _cmd_save(arg: str, session: Session) -> bool:
+    import shutil
+
+    transcript = session.transcript
+    transcript.flush()
+    path = arg.strip()
+    try:
+        if path and path != transcript.name:
+            shutil.copyfile(transcript.name, path)
+            print(f"Saved transcript to {path}")
+        else:
+            print(f"Transcript is at {transcript.name}")
+    except Exception as e:
+        print_err(f"Failed to save transcript: {e}")
+    return True
 
-    options: Dict = {}
-    if temperature is not None:
-        options["temperature"] = temperature
-    if num_ctx is not None:
-        options["num_ctx"] = num_ctx
-    if num_predict is not None:
-        options["num_predict"] = num_predict
+
+# Handlers take (argument, session) and return False to end the chat loop.
+# Built once so each turn is a single dict lookup instead of a chain of
+# string comparisons.
+_COMMANDS = {
+    "/exit": _cmd_exit,
+    "/quit": _cmd_exit,
+    "/help": _cmd_help,
+    "/reset": _cmd_reset,
+    "/save": _cmd_save,
+}
+
+
+def interactive_chat(
+    model: str,
+    system_prompt: Optional[str],
+    options: Dict,
+    no_stream: bool,
+) -> None:
+    try:
+        # Importing readline upgrades input() in place: line editing, arrow-key
+        # history, and a GNU readline prompt loop that handles redraws in C.
+        import readline  # noqa: F401
+    except ImportError:
+        pass  # not built on this platform; input() still works, just bare
+
+    session = _prepare_session(model, system_prompt, options, no_stream)
+    if session is None:
+        return
+
+    # Append-only NDJSON transcript, one message per line, written as the
+    # conversation happens. A crash loses nothing, and /save no longer has to
+    # re-serialize the entire history - it just copies this file.
+    transcript = open(f"chat_{int(time.time())}.ndjson", "a", encoding="utf-8", buffering=1)
+    session.transcript = transcript
+    for m in session.history:
+        transcript.write(m.encoded.decode("utf-8") + "\n")
 
     print(f"Model: {model}")
     print("Type '/help' for commands. Start chatting.\n")
 
-    while True:
-        try:
-            user = input("You> ").strip()
-        except (EOFError, KeyboardInterrupt):
-            print("\nExiting.")
-            break
-
-        if not user:
-            continue
-
-        if user in {"/exit", "/quit"}:
-            break
-        if user == "/help":
-            print(
-                "Commands:\n"
-                "  /exit or /quit   Exit the chat\n"
-                "  /reset           Reset the conversation history\n"
-                "  /save <path>     Save transcript to a JSON file\n"
-                "  /help            Show this help\n"
-            )
-            continue
-        if user == "/reset":
-            history = [{"role": "system", "content": system_prompt}] if system_prompt else []
-            print("History reset.")
-            continue
-        if user.startswith("/save"):
-            _, _, path = user.partition(" ")
-            path = path.strip() or f"chat_{int(time.time())}.json"
+    try:
+        while True:
             try:
-                with open(path, "w", encoding="utf-8") as f:
-                    json.dump({"model": model, "history": history}, f, ensure_ascii=False, indent=2)
-                print(f"Saved transcript to {path}")
-            except Exception as e:
-                print_err(f"Failed to save transcript: {e}")
-            continue
+                user = input("You> ").strip()
+            except (EOFError, KeyboardInterrupt):
+                print("\nExiting.")
+                break
 
-        history.append({"role": "user", "content": user})
-        print("Assistant>", end=" ", flush=True)
-        try:
-            resp = stream_chat(
-                host=DEFAULT_HOST,
-                port=DEFAULT_PORT,
-                model=model,
-                messages=history,
-                options=options,
-                stream=not no_stream,
-            )
-            msg = (resp.get("message") or {}).get("content", "") if isinstance(resp, dict) else ""
-            history.append({"role": "assistant", "content": msg})
-        except Exception as e:
-            print_err(f"\nError: {e}")
+            if not user:
+                continue
+
+            if user.startswith("/"):
+                cmd, _, arg = user.partition(" ")
+                handler = _COMMANDS.get(cmd)
+                if handler is not None:
+                    if not handler(arg, session):
+                        break
+                    continue
+
+            history = session.history
+            fragment = Message("user", user)
+            history.append(fragment)
+            transcript.write(fragment.encoded.decode("utf-8") + "\n")
+            print("Assistant>", end=" ", flush=True)
+            payload = _build_payload(session.prefix, _trim_history(history))
+            try:
+                resp = stream_chat(DEFAULT_HOST, DEFAULT_PORT, payload)
+                msg = (resp.get("message") or {}).get("content", "") if isinstance(resp, dict) else ""
+                fragment = Message("assistant", msg)
+                history.append(fragment)
+                transcript.write(fragment.encoded.decode("utf-8") + "\n")
+            except Exception as e:
+                print_err(f"\nError: {e}")
+    finally:
+        transcript.close()
 
 
 def one_shot(
     prompt: str,
     model: str,
     system_prompt: Optional[str],
-    temperature: Optional[float],
-    num_ctx: Optional[int],
-    num_predict: Optional[int],
+    options: Dict,
     no_stream: bool,
 ) -> None:
-    if not is_ollama_running(DEFAULT_HOST, DEFAULT_PORT):
-        print_err(
-            f"Cannot reach Ollama at http://{DEFAULT_HOST}:{DEFAULT_PORT}. Is the daemon running?"
-        )
-        print_err("Start it with: ollama serve")
+    session = _prepare_session(model, system_prompt, options, no_stream)
+    if session is None:
         sys.exit(1)
 
-    ensure_model_available(model)
-
-    history: List[Dict[str, str]] = []
-    if system_prompt:
-        history.append({"role": "system", "content": system_prompt})
-    history.append({"role": "user", "content": prompt})
-
-    options: Dict = {}
-    if temperature is not None:
-        options["temperature"] = temperature
-    if num_ctx is not None:
-        options["num_ctx"] = num_ctx
-    if num_predict is not None:
-        options["num_predict"] = num_predict
+    session.history.append(Message("user", prompt))
+    payload = _build_payload(session.prefix, session.history)
 
     try:
-        stream_chat(
-            host=DEFAULT_HOST,
-            port=DEFAULT_PORT,
-            model=model,
-            messages=history,
-            options=options,
-            stream=not no_stream,
-        )
+        stream_chat(DEFAULT_HOST, DEFAULT_PORT, payload)
     except Exception as e:
         print_err(f"Error: {e}")
         sys.exit(1)
 
 
 def parse_args(argv: List[str]) -> argparse.Namespace:
+    import argparse
+
     parser = argparse.ArgumentParser(description="Terminal chat harness for Ollama SmolLM2")
     parser.add_argument("-m", "--model", default=DEFAULT_MODEL, help="Model name, e.g. smollm2:1.7b")
     parser.add_argument("-s", "--system", default=None, help="Optional system prompt")
@@ -269,7 +548,19 @@ def parse_args(argv: List[str]) -> argparse.Namespace:
     parser.add_argument("--max-tokens", type=int, default=None, help="Max tokens to generate (num_predict)")
     parser.add_argument("--no-stream", action="store_true", help="Disable streaming output")
     parser.add_argument("-p", "--prompt", default=None, help="One-shot prompt (non-interactive)")
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
+    # CLI flags are immutable for the session, so assemble the Ollama options
+    # dict once here rather than in every entry point.
+    args.options = {
+        key: value
+        for key, value in (
+            ("temperature", args.temperature),
+            ("num_ctx", args.ctx),
+            ("num_predict", args.max_tokens),
+        )
+        if value is not None
+    }
+    return args
 
 
 def main(argv: List[str]) -> None:
@@ -279,18 +570,14 @@ def main(argv: List[str]) -> None:
             prompt=args.prompt,
             model=args.model,
             system_prompt=args.system,
-            temperature=args.temperature,
-            num_ctx=args.ctx,
-            num_predict=args.max_tokens,
+            options=args.options,
             no_stream=args.no_stream,
         )
     else:
         interactive_chat(
             model=args.model,
             system_prompt=args.system,
-            temperature=args.temperature,
-            num_ctx=args.ctx,
-            num_predict=args.max_tokens,
+            options=args.options,
             no_stream=args.no_stream,
         )
 